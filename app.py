@@ -1,15 +1,38 @@
 from flask import (
     Flask,
-    render_template_string,
+    Response,
+    abort,
+    before_render_template,
+    g,
+    has_request_context,
+    jsonify,
+    render_template,
     request,
     redirect,
     url_for,
     flash,
     session,
+    template_rendered,
 )
+import click
+from jinja2 import DictLoader, FileSystemBytecodeCache
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime, date, timedelta
+from collections import OrderedDict
+from email.message import EmailMessage
+import csv
+import hmac
+import io
+import json
+import smtplib
 import sqlite3
+import tempfile
+import threading
+import time
 import os
+import random
+import re
+import uuid
 
 app = Flask(__name__)
 
@@ -17,17 +40,128 @@ app = Flask(__name__)
 app.secret_key = "change-this-secret-key"
 
 # New DB file so we can use new schema without conflict
-DB_PATH = "prison_visits_v2.db"
+DB_PATH = os.environ.get("DB_PATH", "prison_visits_v2.db")
 
+# Visitor places for a Saturday that has no explicit capacity yet
+DEFAULT_CAPACITY = int(os.environ.get("DEFAULT_CAPACITY", "2"))
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+
+# Applied to every connection when it is opened; override via environment
+# (auto_vacuum comes first: it only takes effect before the database file is
+# initialized, or at the next full VACUUM)
+SQLITE_PRAGMAS = {
+    "auto_vacuum": os.environ.get("SQLITE_AUTO_VACUUM", "INCREMENTAL"),
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": os.environ.get("SQLITE_CACHE_SIZE", "-16000"),
+    "mmap_size": os.environ.get("SQLITE_MMAP_SIZE", "134217728"),
+    "busy_timeout": os.environ.get("SQLITE_BUSY_TIMEOUT", "5000"),
+}
+
+# Idle connections kept per worker process
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+
+
+def record_query(seconds):
+    """Count one SQL statement against the current request."""
+    if has_request_context() and "sql_queries" in g:
+        g.sql_queries += 1
+        g.sql_seconds += seconds
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that reports every statement to the request metrics."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors (including conn.execute) are TimedCursors."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect():
+    """Open a new connection with the configured pragmas applied."""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, factory=TimedConnection)
     conn.row_factory = sqlite3.Row
+    for name, value in SQLITE_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
     return conn
 
 
-def init_db():
-    conn = get_db()
+_pool = []
+_pool_lock = threading.Lock()
+_pool_pid = os.getpid()
+
+
+def get_db():
+    """Return the connection for the current app context.
+
+    Connections come from a small per-worker pool and go back to it when
+    the app context is torn down, so requests do not pay for opening a
+    connection and re-applying pragmas each time.
+    """
+    global _pool_pid
+    if "db" not in g:
+        with _pool_lock:
+            # Never share connections inherited across a fork
+            if _pool_pid != os.getpid():
+                _pool.clear()
+                _pool_pid = os.getpid()
+            conn = _pool.pop() if _pool else None
+        g.db = conn or connect()
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop("db", None)
+    if conn is None:
+        return
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        if _pool_pid == os.getpid() and len(_pool) < DB_POOL_SIZE:
+            _pool.append(conn)
+            return
+    conn.close()
+
+
+# ---------------------------
+# SCHEMA MIGRATIONS
+# ---------------------------
+
+# Database this app used before DB_PATH moved to prison_visits_v2.db
+LEGACY_DB_PATH = os.environ.get("LEGACY_DB_PATH", "prison_visits.db")
+LEGACY_BATCH_SIZE = 1000
+
+
+def migrate_initial_schema(conn):
+    """1: bookings, slot counters, version counter, job queue, audit log.
+
+    Written with IF NOT EXISTS so databases created before migrations were
+    tracked (user_version 0) are adopted as they are.
+    """
     c = conn.cursor()
     c.execute(
         """
@@ -43,15 +177,706 @@ def init_db():
         )
     """
     )
-    conn.commit()
-    conn.close()
+    # Matches the admin listing order (and keyset cursor); its visit_date
+    # prefix also serves every per-date lookup
+    c.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_bookings_date_created
+        ON bookings (visit_date, created_at, id)
+    """
+    )
+    c.execute("DROP INDEX IF EXISTS idx_bookings_visit_date")
+    # One row per bookable date with its capacity and a running counter, so
+    # availability never has to count bookings
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS slots (
+            visit_date DATE PRIMARY KEY,
+            capacity INTEGER NOT NULL,
+            booked INTEGER NOT NULL DEFAULT 0
+        )
+    """
+    )
+    # Keep the counters in step with every insert/delete on bookings
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS bookings_slot_insert
+        AFTER INSERT ON bookings
+        BEGIN
+            UPDATE slots SET booked = booked + 1 WHERE visit_date = NEW.visit_date;
+        END
+    """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS bookings_slot_delete
+        AFTER DELETE ON bookings
+        BEGIN
+            UPDATE slots SET booked = booked - 1 WHERE visit_date = OLD.visit_date;
+        END
+    """
+    )
+    # Single-row generation counter, bumped whenever any slot changes. Every
+    # worker compares it against its cached availability, so a write in one
+    # gunicorn process invalidates the caches in all of them.
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    """
+    )
+    c.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        c.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS slots_version_{event.lower()}
+            AFTER {event} ON slots
+            BEGIN
+                UPDATE data_version SET version = version + 1 WHERE id = 1;
+            END
+        """
+        )
+    # Durable queue for work done after the response (emails, audit log).
+    # run_at doubles as a lease: a claimed job becomes due again if its
+    # worker dies before finishing it.
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_at DATETIME NOT NULL,
+            last_error TEXT,
+            created_at DATETIME NOT NULL
+        )
+    """
+    )
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, run_at)")
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action TEXT NOT NULL,
+            details TEXT NOT NULL,
+            created_at DATETIME NOT NULL
+        )
+    """
+    )
+    # Backfill counters for dates booked before the slots table existed
+    c.execute(
+        """
+        INSERT OR IGNORE INTO slots (visit_date, capacity, booked)
+        SELECT visit_date, ?, COUNT(*) FROM bookings GROUP BY visit_date
+    """,
+        (DEFAULT_CAPACITY,),
+    )
+
+
+def migrate_legacy_bookings(conn):
+    """2: copy bookings from the legacy database file, if there is one.
+
+    The old schema had a single name column and no SSN or phone, so the
+    name is split into first/last and the missing fields are left empty.
+    Rows are read and inserted in id-ordered batches.
+    """
+    if not os.path.exists(LEGACY_DB_PATH) or os.path.samefile(LEGACY_DB_PATH, DB_PATH):
+        return
+    legacy = sqlite3.connect(f"file:{LEGACY_DB_PATH}?mode=ro", uri=True)
+    try:
+        columns = {row[1] for row in legacy.execute("PRAGMA table_info(bookings)")}
+        if not {"id", "visit_date", "name", "email", "created_at"} <= columns:
+            return
+        last_id = 0
+        while True:
+            rows = legacy.execute(
+                """
+                SELECT id, visit_date, name, email, created_at FROM bookings
+                WHERE id > ? ORDER BY id LIMIT ?
+                """,
+                (last_id, LEGACY_BATCH_SIZE),
+            ).fetchall()
+            if not rows:
+                break
+            batch = []
+            for _, visit_date, name, email, created_at in rows:
+                first_name, _, last_name = name.strip().partition(" ")
+                last_name = last_name.strip()
+                batch.append(
+                    (visit_date, first_name, last_name, "", "", email, created_at)
+                )
+            conn.executemany(
+                "INSERT OR IGNORE INTO slots (visit_date, capacity) VALUES (?, ?)",
+                {(b[0], DEFAULT_CAPACITY) for b in batch},
+            )
+            conn.executemany(
+                """
+                INSERT INTO bookings (
+                    visit_date, first_name, last_name, ssn, phone, email, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                batch,
+            )
+            last_id = rows[-1][0]
+    finally:
+        legacy.close()
+
+
+# Phone numbers are indexed as digits only, so "070-123 45", "(070) 123" and
+# "070.123.45" find "07012345"; fts_query reduces phone-like searches the
+# same way
+PHONE_SEPARATORS = " -()+./"
+NORMALIZED_PHONE = "{col}"
+for _char in PHONE_SEPARATORS:
+    NORMALIZED_PHONE = f"replace({NORMALIZED_PHONE}, '{_char}', '')"
+
+
+def create_search_index(conn, table="bookings", schema="main"):
+    """Create {table}_fts, its triggers, and index every row of table.
+
+    The index is contentless: the phone column holds NORMALIZED_PHONE, not
+    what the table stores, so FTS5 must never read the table itself (as
+    'rebuild' and 'integrity-check' would for an external-content table).
+    Deletes pass the indexed values back explicitly.
+    """
+    c = conn.cursor()
+    fts = f"{table}_fts"
+    c.execute(
+        f"""
+        CREATE VIRTUAL TABLE {schema}.{fts} USING fts5(
+            first_name, last_name, email, phone,
+            content = '',
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+    """
+    )
+    new_values = (
+        f"NEW.id, NEW.first_name, NEW.last_name, NEW.email, "
+        f"{NORMALIZED_PHONE.format(col='NEW.phone')}"
+    )
+    old_values = (
+        f"'delete', OLD.id, OLD.first_name, OLD.last_name, OLD.email, "
+        f"{NORMALIZED_PHONE.format(col='OLD.phone')}"
+    )
+    columns = "rowid, first_name, last_name, email, phone"
+    c.execute(
+        f"""
+        CREATE TRIGGER {schema}.{fts}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts} ({columns}) VALUES ({new_values});
+        END
+    """
+    )
+    c.execute(
+        f"""
+        CREATE TRIGGER {schema}.{fts}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, {columns}) VALUES ({old_values});
+        END
+    """
+    )
+    c.execute(
+        f"""
+        CREATE TRIGGER {schema}.{fts}_update AFTER UPDATE ON {table} BEGIN
+            INSERT INTO {fts} ({fts}, {columns}) VALUES ({old_values});
+            INSERT INTO {fts} ({columns}) VALUES ({new_values});
+        END
+    """
+    )
+    c.execute(
+        f"""
+        INSERT INTO {schema}.{fts} ({columns})
+        SELECT id, first_name, last_name, email, {NORMALIZED_PHONE.format(col='phone')}
+        FROM {schema}.{table}
+    """
+    )
+
+
+def migrate_search_index(conn):
+    """3: FTS5 index over visitor names, email and phone, kept by triggers."""
+    create_search_index(conn)
+
+
+def migrate_admission_control(conn):
+    """4: unique visitor per date, and idempotency keys for the booking form.
+
+    Rows that would break the unique (visit_date, ssn) index -- repeat
+    submissions from before it existed -- are moved to bookings_duplicates
+    rather than dropped. Legacy rows without an SSN are exempt.
+    """
+    c = conn.cursor()
+    c.execute(
+        """
+        CREATE TABLE bookings_duplicates AS
+        SELECT * FROM bookings WHERE ssn != '' AND id NOT IN (
+            SELECT MIN(id) FROM bookings WHERE ssn != '' GROUP BY visit_date, ssn
+        )
+    """
+    )
+    c.execute("DELETE FROM bookings WHERE id IN (SELECT id FROM bookings_duplicates)")
+    c.execute(
+        """
+        CREATE UNIQUE INDEX idx_bookings_date_ssn
+        ON bookings (visit_date, ssn) WHERE ssn != ''
+    """
+    )
+    c.execute(
+        """
+        CREATE TABLE idempotency_keys (
+            key TEXT PRIMARY KEY,
+            outcome TEXT NOT NULL,
+            booking_id INTEGER,
+            created_at DATETIME NOT NULL
+        )
+    """
+    )
+
+
+def migrate_contentless_search_index(conn):
+    """5: rebuild bookings_fts as a contentless index.
+
+    Version 3 created it with content='bookings', whose phone column does
+    not hold the normalized digits that were indexed. Rebuilding also
+    applies the current PHONE_SEPARATORS to existing rows.
+    """
+    c = conn.cursor()
+    for trigger in ("insert", "delete", "update"):
+        c.execute(f"DROP TRIGGER IF EXISTS bookings_fts_{trigger}")
+    c.execute("DROP TABLE IF EXISTS bookings_fts")
+    create_search_index(conn)
+
+
+def create_archive_schema(conn, schema):
+    """Create bookings_archive and its indexes in schema, if missing."""
+    c = conn.cursor()
+    c.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {schema}.bookings_archive (
+            id INTEGER PRIMARY KEY,
+            visit_date DATE NOT NULL,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            ssn TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            email TEXT NOT NULL,
+            created_at DATETIME NOT NULL,
+            archived_at DATETIME NOT NULL
+        )
+    """
+    )
+    c.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS {schema}.idx_archive_date_created
+        ON bookings_archive (visit_date, created_at, id)
+    """
+    )
+    exists = c.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'bookings_archive_fts'"
+    ).fetchone()
+    if not exists:
+        create_search_index(conn, "bookings_archive", schema)
+
+
+def migrate_archive(conn):
+    """6: in-file archive with its search index; quieter data_version.
+
+    Archiving decrements the counters of long-past slots, which no page
+    shows, so only slots from yesterday on bump data_version (a day of
+    slack for the server's timezone). Otherwise every archive batch would
+    invalidate every worker's availability cache and API ETag.
+    """
+    create_archive_schema(conn, "main")
+    c = conn.cursor()
+    c.execute("DROP TRIGGER slots_version_update")
+    c.execute(
+        """
+        CREATE TRIGGER slots_version_update
+        AFTER UPDATE ON slots
+        WHEN NEW.visit_date >= date('now', '-1 day')
+        BEGIN
+            UPDATE data_version SET version = version + 1 WHERE id = 1;
+        END
+    """
+    )
+
+
+# Applied in order; PRAGMA user_version records how many have run. Only
+# ever append to this list.
+MIGRATIONS = [
+    migrate_initial_schema,
+    migrate_legacy_bookings,
+    migrate_search_index,
+    migrate_admission_control,
+    migrate_contentless_search_index,
+    migrate_archive,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, echo=None):
+    """Apply pending migrations, each in its own write transaction.
+
+    BEGIN IMMEDIATE serializes concurrent callers, and the version is
+    re-read inside the transaction, so every migration runs exactly once.
+    """
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            if version >= SCHEMA_VERSION:
+                conn.rollback()
+                return version
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if echo:
+            echo(f"Applied migration {version + 1}: {MIGRATIONS[version].__name__}")
+
+
+def ensure_schema():
+    """Check the schema version, migrating only if it is behind.
+
+    Normally the migrations have already run ('flask migrate', or the
+    gunicorn on_starting hook before workers fork), so workers just read
+    PRAGMA user_version. Returns the version found before migrating.
+    """
+    conn = connect()
+    try:
+        version = schema_version(conn)
+        if version < SCHEMA_VERSION:
+            migrate(conn, echo=app.logger.info)
+    finally:
+        conn.close()
+    return version
+
+
+# ✅ CHECK THE DB SCHEMA WHEN THE APP IS IMPORTED (important for Render/gunicorn)
+SCHEMA_VERSION_AT_IMPORT = ensure_schema()
+
+
+# ---------------------------
+# METRICS
+# ---------------------------
+
+# Each worker writes its counters here so /metrics can add them all up;
+# gunicorn.conf.py empties it on start and folds exited workers into
+# exited.json
+METRICS_DIR = os.environ.get(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "prison-metrics")
+)
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "1"))
+
+# Scrapers send "Authorization: Bearer <METRICS_TOKEN>"; without a token
+# set, /metrics is only shown to a logged-in admin
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Requests slower than this, or running more statements, get logged
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "500"))
+SLOW_REQUEST_QUERIES = int(os.environ.get("SLOW_REQUEST_QUERIES", "20"))
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# name: (help text, label name, bucket upper bounds)
+HISTOGRAMS = {
+    "prison_request_duration_seconds": (
+        "Request latency by endpoint.",
+        "endpoint",
+        SECONDS_BUCKETS,
+    ),
+    "prison_request_sql_queries": (
+        "SQL statements executed per request by endpoint.",
+        "endpoint",
+        (0, 1, 2, 5, 10, 20, 50, 100),
+    ),
+    "prison_request_sql_duration_seconds": (
+        "Time spent executing SQL per request by endpoint.",
+        "endpoint",
+        SECONDS_BUCKETS,
+    ),
+    "prison_template_render_seconds": (
+        "Template render time by template.",
+        "template",
+        SECONDS_BUCKETS,
+    ),
+}
+
+
+class Metrics:
+    """Histograms for this worker process.
+
+    Snapshots are written to METRICS_DIR (at most every
+    METRICS_FLUSH_INTERVAL seconds) so that any worker serving /metrics
+    can report totals for all of them.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._flushed_at = 0.0
+
+    def observe(self, name, label, value):
+        bounds = HISTOGRAMS[name][2]
+        with self._lock:
+            hist = self._data.setdefault(name, {}).setdefault(
+                label, {"buckets": [0] * len(bounds), "sum": 0.0, "count": 0}
+            )
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._flushed_at < METRICS_FLUSH_INTERVAL:
+            return
+        with self._lock:
+            snapshot = json.dumps(self._data)
+            self._flushed_at = now
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            f.write(snapshot)
+        os.replace(path + ".tmp", path)
+
+
+metrics = Metrics()
+
+
+def collect_metrics():
+    """Sum the snapshots of every worker found in METRICS_DIR."""
+    total = {}
+    for filename in os.listdir(METRICS_DIR):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels in data.items():
+            if name not in HISTOGRAMS:
+                continue
+            for label, hist in labels.items():
+                acc = total.setdefault(name, {}).setdefault(
+                    label,
+                    {"buckets": [0] * len(hist["buckets"]), "sum": 0.0, "count": 0},
+                )
+                acc["buckets"] = [
+                    a + b for a, b in zip(acc["buckets"], hist["buckets"])
+                ]
+                acc["sum"] += hist["sum"]
+                acc["count"] += hist["count"]
+    return total
+
+
+def render_metrics(total):
+    """Format collected histograms in the Prometheus text format."""
+    lines = []
+    for name, (help_text, label_name, bounds) in HISTOGRAMS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for label, hist in sorted(total.get(name, {}).items()):
+            tag = f'{label_name}="{label}"'
+            for bound, count in zip(bounds, hist["buckets"]):
+                lines.append(f'{name}_bucket{{{tag},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{tag},le="+Inf"}} {hist["count"]}')
+            lines.append(f"{name}_sum{{{tag}}} {hist['sum']}")
+            lines.append(f"{name}_count{{{tag}}} {hist['count']}")
+    return "\n".join(lines) + "\n"
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+
+
+@app.teardown_request
+def record_request(exc):
+    if "request_start" not in g:
+        return
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or "unmatched"
+    metrics.observe("prison_request_duration_seconds", endpoint, elapsed)
+    metrics.observe("prison_request_sql_queries", endpoint, g.sql_queries)
+    metrics.observe("prison_request_sql_duration_seconds", endpoint, g.sql_seconds)
+    if elapsed * 1000 > SLOW_REQUEST_MS or g.sql_queries > SLOW_REQUEST_QUERIES:
+        app.logger.warning(
+            "Slow request %s %s: %.1f ms, %d SQL statements (%.1f ms)",
+            request.method,
+            request.path,
+            elapsed * 1000,
+            g.sql_queries,
+            g.sql_seconds * 1000,
+        )
+    metrics.flush()
 
 
-# ✅ RUN DB INIT WHEN THE APP IS IMPORTED (important for Render/gunicorn)
-init_db()
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
 
 
-def next_saturdays(n=8):
+@template_rendered.connect_via(app)
+def record_render(sender, template, context, **extra):
+    start = g.pop("render_start", None)
+    if start is not None:
+        metrics.observe(
+            "prison_template_render_seconds",
+            template.name or "<string>",
+            time.perf_counter() - start,
+        )
+
+
+@app.route("/metrics")
+def metrics_view():
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    authorized = METRICS_TOKEN and hmac.compare_digest(token, METRICS_TOKEN)
+    if not (authorized or session.get("admin")):
+        return Response("Forbidden\n", status=403, mimetype="text/plain")
+    metrics.flush(force=True)
+    return Response(
+        render_metrics(collect_metrics()),
+        mimetype="text/plain; version=0.0.4",
+    )
+
+
+# ---------------------------
+# RATE LIMITING
+# ---------------------------
+
+# Behind a reverse proxy, set to the number of proxies that add
+# X-Forwarded-For so the limiter sees the real client address
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", "0"))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
+# Off by default until TRUSTED_PROXIES is set: without it every request
+# behind the proxy comes from the proxy's address and shares one bucket
+RATE_LIMITS_ENABLED = (
+    os.environ.get("RATE_LIMITS_ENABLED", "1" if TRUSTED_PROXIES else "0") == "1"
+)
+if RATE_LIMITS_ENABLED and not TRUSTED_PROXIES:
+    app.logger.warning(
+        "RATE_LIMITS_ENABLED without TRUSTED_PROXIES: clients are told apart "
+        "by REMOTE_ADDR, which behind a reverse proxy is the proxy itself"
+    )
+
+# Token buckets live in their own small SQLite file, shared by every worker
+# on the host but never contending with the bookings database's write lock
+RATE_LIMIT_DB_PATH = os.environ.get(
+    "RATE_LIMIT_DB_PATH", os.path.join(tempfile.gettempdir(), "prison-ratelimit.db")
+)
+
+# "endpoint:METHOD" -> (tokens added per second, bucket size), per client IP.
+# Override with e.g. RATE_LIMITS="book:POST=0.1/5,index:GET=1/20".
+RATE_LIMITS = {
+    "index:GET": (2.0, 30),
+    "book:GET": (1.0, 20),
+    "book:POST": (0.2, 5),
+    "api_availability:GET": (2.0, 30),
+    "admin_login:POST": (0.1, 5),
+}
+for _item in filter(None, os.environ.get("RATE_LIMITS", "").split(",")):
+    _route, _, _limit = _item.partition("=")
+    _rate, _, _burst = _limit.partition("/")
+    RATE_LIMITS[_route.strip()] = (float(_rate), int(_burst))
+
+
+_limiter = threading.local()
+
+
+def limiter_db():
+    """Per-thread autocommit connection to the rate limit database."""
+    conn = getattr(_limiter, "conn", None)
+    if conn is None or _limiter.pid != os.getpid():
+        conn = sqlite3.connect(RATE_LIMIT_DB_PATH, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA busy_timeout = 100")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                allowed INTEGER NOT NULL
+            )
+        """
+        )
+        _limiter.conn = conn
+        _limiter.pid = os.getpid()
+    return conn
+
+
+def take_token(key, rate, burst):
+    """Take one token from key's bucket; return seconds to wait, or 0."""
+    now = time.time()
+    # One statement refills the bucket for the time elapsed and takes a
+    # token if there is one, so concurrent workers cannot both take the last
+    refill = "min(:burst, tokens + (:now - updated) * :rate)"
+    cursor = limiter_db().execute(
+        f"""
+        INSERT INTO buckets (key, tokens, updated, allowed)
+        VALUES (:key, :burst - 1, :now, 1)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = CASE WHEN {refill} >= 1 THEN {refill} - 1 ELSE {refill} END,
+            allowed = {refill} >= 1,
+            updated = :now
+        RETURNING tokens, allowed
+        """,
+        {"key": key, "rate": rate, "burst": burst, "now": now},
+    )
+    tokens, allowed = cursor.fetchone()
+    if allowed:
+        return 0
+    return (1 - tokens) / rate
+
+
+def prune_buckets(max_age=3600):
+    cutoff = time.time() - max_age
+    limiter_db().execute("DELETE FROM buckets WHERE updated < ?", (cutoff,))
+
+
+@app.before_request
+def rate_limit():
+    if not RATE_LIMITS_ENABLED:
+        return None
+    route = f"{request.endpoint}:{request.method}"
+    limit = RATE_LIMITS.get(route)
+    if limit is None:
+        return None
+    try:
+        wait = take_token(f"{request.remote_addr}|{route}", *limit)
+        # Forget idle clients now and then
+        if random.random() < 0.001:
+            prune_buckets()
+    except sqlite3.Error as e:
+        # Fail open: never turn visitors away because the limiter is busy
+        app.logger.warning("Rate limiter unavailable: %s", e)
+        return None
+    if wait:
+        response = Response("Too many requests, please wait a moment.\n", status=429)
+        response.headers["Retry-After"] = str(max(1, int(wait + 0.5)))
+        return response
+    return None
+
+
+# How many Saturdays ahead are shown on the public page (8 weeks .. 1 year)
+BOOKING_WEEKS = min(max(int(os.environ.get("BOOKING_WEEKS", "8")), 1), 52)
+
+
+def next_saturdays(n=BOOKING_WEEKS):
     """Return list of next n Saturdays as date objects."""
     today = date.today()
     # weekday(): Monday=0 ... Sunday=6; Saturday=5
@@ -65,11 +890,463 @@ def next_saturdays(n=8):
     return sats
 
 
+# ---------------------------
+# AVAILABILITY CALENDAR
+# ---------------------------
+
+
+def availability(conn, days):
+    """Return {date: (booked, capacity)} for the given dates.
+
+    Reads the per-date counters in one range query over the slots table,
+    so the cost does not grow with the number of days shown.
+    """
+    counts = {d: (0, DEFAULT_CAPACITY) for d in days}
+    if not days:
+        return counts
+    c = conn.cursor()
+    c.execute(
+        """
+        SELECT visit_date, booked, capacity FROM slots
+        WHERE visit_date BETWEEN ? AND ?
+        """,
+        (min(days).isoformat(), max(days).isoformat()),
+    )
+    for row in c.fetchall():
+        d = date.fromisoformat(row["visit_date"])
+        if d in counts:
+            counts[d] = (row["booked"], row["capacity"])
+    return counts
+
+
+def data_version(conn):
+    """Return the current generation of the slots data."""
+    return conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()[0]
+
+
+class AvailabilityCache:
+    """Small LRU cache of availability results with a TTL.
+
+    An entry is only served while it is younger than ttl seconds and was
+    computed at the current data_version. The version itself is re-read at
+    most every version_interval seconds, so a hit costs no query at all
+    and writes from other workers show up within that interval; this
+    worker's own writes clear() the cache and show up at once.
+    """
+
+    def __init__(self, ttl, maxsize, version_interval):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.version_interval = version_interval
+        self._entries = OrderedDict()
+        self._version = None
+        self._version_read_at = 0.0
+        self._lock = threading.Lock()
+
+    def version(self, conn):
+        """data_version, read from conn at most every version_interval."""
+        now = time.monotonic()
+        with self._lock:
+            if (
+                self._version is not None
+                and now - self._version_read_at < self.version_interval
+            ):
+                return self._version
+        version = data_version(conn)
+        with self._lock:
+            self._version, self._version_read_at = version, now
+        return version
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, entry_version, value = entry
+            if entry_version != version or expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+availability_cache = AvailabilityCache(
+    ttl=float(os.environ.get("AVAILABILITY_CACHE_TTL", "30")),
+    maxsize=int(os.environ.get("AVAILABILITY_CACHE_SIZE", "64")),
+    version_interval=float(os.environ.get("AVAILABILITY_VERSION_INTERVAL", "0.5")),
+)
+
+
+def cached_availability(conn, days):
+    """availability() served from availability_cache when still current."""
+    key = tuple(days)
+    version = availability_cache.version(conn)
+    counts = availability_cache.get(key, version)
+    if counts is None:
+        counts = availability(conn, days)
+        availability_cache.put(key, version, counts)
+    return counts
+
+
+def ensure_slot(conn, visit_date):
+    """Create the slot row for visit_date with the default capacity."""
+    conn.execute(
+        "INSERT OR IGNORE INTO slots (visit_date, capacity) VALUES (?, ?)",
+        (visit_date.isoformat(), DEFAULT_CAPACITY),
+    )
+
+
+def replayed_booking(conn, idempotency_key):
+    """Return the stored (outcome, booking_id) for a key, or None.
+
+    A "booked" result whose booking has since been deleted is reported as
+    "cancelled", so a resubmitted form never confirms a cancelled visit.
+    """
+    row = conn.execute(
+        """
+        SELECT k.outcome, k.booking_id, b.id IS NULL AS gone
+        FROM idempotency_keys k LEFT JOIN bookings b ON b.id = k.booking_id
+        WHERE k.key = ?
+        """,
+        (idempotency_key,),
+    ).fetchone()
+    if row is None:
+        return None
+    if row["outcome"] == "booked" and row["gone"]:
+        return "cancelled", row["booking_id"]
+    return row["outcome"], row["booking_id"]
+
+
+def insert_booking(
+    conn, visit_date, first_name, last_name, ssn, phone, email, idempotency_key=None
+):
+    """Book a place on visit_date in one transaction.
+
+    The insert only happens while the slot still has room, and the unique
+    (visit_date, ssn) index refuses a visitor already booked that day; the
+    bookings trigger bumps the counter inside the same write transaction,
+    so concurrent requests cannot overbook. A new booking's audit entry and
+    confirmation email are queued in that same transaction. If
+    idempotency_key was seen before, the original result is returned and
+    nothing is inserted.
+
+    Returns (outcome, booking_id, replayed) where outcome is "booked",
+    "full" or "duplicate", or for a replay "cancelled" if the booking has
+    been deleted since.
+    """
+    if idempotency_key:
+        replay = replayed_booking(conn, idempotency_key)
+        if replay:
+            return *replay, True
+
+    # Cheap read first so requests for a full day never take the write lock
+    booked, capacity = availability(conn, [visit_date])[visit_date]
+    if booked >= capacity:
+        return "full", None, False
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if idempotency_key:
+            replay = replayed_booking(conn, idempotency_key)
+            if replay:
+                conn.rollback()
+                return *replay, True
+
+        ensure_slot(conn, visit_date)
+        booking_id = None
+        try:
+            c = conn.execute(
+                """
+                INSERT INTO bookings (
+                    visit_date, first_name, last_name, ssn, phone, email, created_at
+                )
+                SELECT ?, ?, ?, ?, ?, ?, ?
+                WHERE EXISTS (
+                    SELECT 1 FROM slots WHERE visit_date = ? AND booked < capacity
+                )
+                """,
+                (
+                    visit_date.isoformat(),
+                    first_name,
+                    last_name,
+                    ssn,
+                    phone,
+                    email,
+                    datetime.utcnow().isoformat(),
+                    visit_date.isoformat(),
+                ),
+            )
+        except sqlite3.IntegrityError:
+            # The unique (visit_date, ssn) index rejected a second booking for
+            # this visitor; only the statement is undone, the transaction
+            # stays open to record the idempotency key
+            outcome = "duplicate"
+        else:
+            if c.rowcount:
+                outcome, booking_id = "booked", c.lastrowid
+                enqueue_audit(
+                    conn,
+                    "booking_created",
+                    commit=False,
+                    booking_id=booking_id,
+                    visit_date=visit_date.isoformat(),
+                )
+                enqueue_visit_email(
+                    conn, "booked", email, first_name, visit_date, commit=False
+                )
+            else:
+                outcome = "full"
+
+        if idempotency_key:
+            conn.execute(
+                """
+                INSERT INTO idempotency_keys (key, outcome, booking_id, created_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                (idempotency_key, outcome, booking_id, datetime.utcnow().isoformat()),
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return outcome, booking_id, False
+
+
+# ---------------------------
+# BACKGROUND JOBS
+# ---------------------------
+
+# Seconds a worker may hold a job before another worker may retry it
+JOB_LEASE = int(os.environ.get("JOB_LEASE", "300"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+# Retry n waits JOB_BACKOFF * 2**(n-1) seconds
+JOB_BACKOFF = float(os.environ.get("JOB_BACKOFF", "30"))
+
+SMTP_HOST = os.environ.get("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "25"))
+SMTP_USER = os.environ.get("SMTP_USER", "")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "") == "1"
+MAIL_FROM = os.environ.get("MAIL_FROM", "visits@localhost")
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+    """Register the function that runs jobs of the given kind.
+
+    Handlers get the worker's connection and must not commit: run_job does,
+    once the job is marked done.
+    """
+
+    def register(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+
+    return register
+
+
+def enqueue(conn, kind, payload, commit=True):
+    """Add a job to the queue; a worker picks it up later.
+
+    With commit=False the job joins the caller's open transaction, so it is
+    queued if and only if the change it reports is committed.
+    """
+    now = datetime.utcnow().isoformat()
+    conn.execute(
+        "INSERT INTO jobs (kind, payload, run_at, created_at) VALUES (?, ?, ?, ?)",
+        (kind, json.dumps(payload), now, now),
+    )
+    if commit:
+        conn.commit()
+
+
+def claim_job(conn):
+    """Atomically take the next due job, or return None.
+
+    An idle poll is a plain read on idx_jobs_due; only when a job is due
+    does the claiming UPDATE take the write lock that book() also needs.
+    """
+    now = datetime.utcnow()
+    due = conn.execute(
+        """
+        SELECT 1 FROM jobs
+        WHERE status IN ('pending', 'running') AND run_at <= ? LIMIT 1
+        """,
+        (now.isoformat(),),
+    ).fetchone()
+    if due is None:
+        return None
+    row = conn.execute(
+        """
+        UPDATE jobs SET status = 'running', attempts = attempts + 1, run_at = ?
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE status IN ('pending', 'running') AND run_at <= ?
+            ORDER BY run_at, id LIMIT 1
+        )
+        RETURNING id, kind, payload, attempts
+        """,
+        ((now + timedelta(seconds=JOB_LEASE)).isoformat(), now.isoformat()),
+    ).fetchone()
+    conn.commit()
+    return row
+
+
+def run_job(conn, job):
+    """Run one claimed job and record success, a retry or failure.
+
+    The handler's own writes commit together with the job's 'done' status,
+    so a job that is retried has left nothing behind.
+    """
+    try:
+        handler = JOB_HANDLERS[job["kind"]]
+        handler(conn, json.loads(job["payload"]))
+        conn.execute("UPDATE jobs SET status = 'done' WHERE id = ?", (job["id"],))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        error = f"{type(e).__name__}: {e}"
+        if job["attempts"] >= JOB_MAX_ATTEMPTS:
+            app.logger.error("Job %s (%s) failed: %s", job["id"], job["kind"], error)
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', last_error = ? WHERE id = ?",
+                (error, job["id"]),
+            )
+        else:
+            delay = JOB_BACKOFF * 2 ** (job["attempts"] - 1)
+            retry_at = datetime.utcnow() + timedelta(seconds=delay)
+            conn.execute(
+                """
+                UPDATE jobs SET status = 'pending', run_at = ?, last_error = ?
+                WHERE id = ?
+                """,
+                (retry_at.isoformat(), error, job["id"]),
+            )
+        conn.commit()
+        return False
+    return True
+
+
+def run_worker(threads=2, poll_interval=1.0, once=False):
+    """Process jobs until interrupted (or until the queue is empty if once)."""
+
+    def loop():
+        conn = connect()
+        try:
+            while True:
+                job = claim_job(conn)
+                if job is not None:
+                    run_job(conn, job)
+                elif once:
+                    return
+                else:
+                    time.sleep(poll_interval)
+        finally:
+            conn.close()
+
+    workers = [threading.Thread(target=loop, daemon=True) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+
+
+@job_handler("email")
+def send_email_job(conn, payload):
+    msg = EmailMessage()
+    msg["From"] = MAIL_FROM
+    msg["To"] = payload["to"]
+    msg["Subject"] = payload["subject"]
+    msg.set_content(payload["body"])
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as smtp:
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        smtp.send_message(msg)
+
+
+@job_handler("audit")
+def audit_job(conn, payload):
+    conn.execute(
+        "INSERT INTO audit_log (action, details, created_at) VALUES (?, ?, ?)",
+        (payload["action"], json.dumps(payload["details"]), payload["at"]),
+    )
+
+
+def enqueue_audit(conn, action, commit=True, **details):
+    enqueue(
+        conn,
+        "audit",
+        {"action": action, "details": details, "at": datetime.utcnow().isoformat()},
+        commit=commit,
+    )
+
+
+def enqueue_email(conn, to, subject, body, commit=True):
+    enqueue(conn, "email", {"to": to, "subject": subject, "body": body}, commit=commit)
+
+
+# event -> (subject, what happened to the visit)
+VISIT_EMAILS = {
+    "booked": ("Your visit is booked", "is confirmed"),
+    "cancelled": ("Your visit has been cancelled", "has been cancelled"),
+}
+
+
+def enqueue_visit_email(conn, event, to, first_name, visit_date, commit=True):
+    """Tell a visitor that their visit on visit_date was booked or cancelled."""
+    subject, news = VISIT_EMAILS[event]
+    enqueue_email(
+        conn,
+        to,
+        subject,
+        f"Hello {first_name},\n\n"
+        f"Your visit on {visit_date.strftime('%A %d %B %Y')} {news}.\n",
+        commit=commit,
+    )
+
+
 # ---------------------------
 # ADMIN LOGIN / LOGOUT
 # ---------------------------
 
 
+ADMIN_LOGIN_TEMPLATE = """
+<!doctype html>
+<html>
+<body style="font-family: sans-serif; max-width: 400px; margin: 40px auto;">
+    <h2>Admin Login</h2>
+
+    {% if error %}
+      <p style="color:red;">{{ error }}</p>
+    {% endif %}
+
+    <form method="post">
+        <label>Password
+            <input type="password" name="password" style="width:100%; padding:6px;">
+        </label>
+        <button style="margin-top:15px;">Login</button>
+    </form>
+    <p><a href="{{ url_for('index') }}">← Back</a></p>
+</body>
+</html>
+"""
+
+
 @app.route("/admin-login", methods=["GET", "POST"])
 def admin_login():
     error = None
@@ -84,27 +1361,7 @@ def admin_login():
         else:
             error = "Incorrect password."
 
-    template = """
-    <!doctype html>
-    <html>
-    <body style="font-family: sans-serif; max-width: 400px; margin: 40px auto;">
-        <h2>Admin Login</h2>
-
-        {% if error %}
-          <p style="color:red;">{{ error }}</p>
-        {% endif %}
-
-        <form method="post">
-            <label>Password
-                <input type="password" name="password" style="width:100%; padding:6px;">
-            </label>
-            <button style="margin-top:15px;">Login</button>
-        </form>
-        <p><a href="{{ url_for('index') }}">← Back</a></p>
-    </body>
-    </html>
-    """
-    return render_template_string(template, error=error)
+    return render_template("admin_login.html", error=error)
 
 
 @app.route("/logout")
@@ -118,76 +1375,107 @@ def logout():
 # ---------------------------
 
 
+INDEX_TEMPLATE = """
+<!doctype html>
+<html>
+<head>
+    <title>Prison Visit Booking</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <style>
+        body { font-family: sans-serif; max-width: 700px; margin: 20px auto; padding: 0 10px; }
+        .date-card { border: 1px solid #ccc; border-radius: 8px; padding: 10px 15px; margin-bottom: 10px; }
+        .full { background: #f8d7da; }
+        .available { background: #d4edda; }
+        .btn { padding: 6px 12px; border-radius: 4px; border: none; cursor: pointer; }
+        .btn-primary { background: #007bff; color: white; }
+        .btn-disabled { background: #aaa; color: #eee; cursor: not-allowed; }
+        .flash { padding: 8px 10px; border-radius: 4px; margin-bottom: 10px; }
+        .flash-error { background: #f8d7da; }
+        .flash-success { background: #d4edda; }
+    </style>
+</head>
+<body>
+    <h1>Book a Visit</h1>
+    <p>Choose a Saturday. Places are limited each day.</p>
+
+    {% with messages = get_flashed_messages(with_categories=true) %}
+      {% if messages %}
+        {% for category, msg in messages %}
+          <div class="flash flash-{{ category }}">{{ msg }}</div>
+        {% endfor %}
+      {% endif %}
+    {% endwith %}
+
+    {% for d, count, capacity in days %}
+        <div class="date-card {% if count >= capacity %}full{% else %}available{% endif %}">
+            <strong>{{ d.strftime("%A %d %B %Y") }}</strong><br>
+            Booked: {{ count }}/{{ capacity }}
+            <div style="margin-top:8px;">
+            {% if count < capacity %}
+                <form method="get" action="{{ url_for('book') }}" style="display:inline;">
+                    <input type="hidden" name="date" value="{{ d.isoformat() }}">
+                    <button class="btn btn-primary" type="submit">Book</button>
+                </form>
+            {% else %}
+                <button class="btn btn-disabled" disabled>Full</button>
+            {% endif %}
+            </div>
+        </div>
+    {% endfor %}
+
+    <p><a href="{{ url_for('admin_login') }}">Admin</a></p>
+</body>
+</html>
+"""
+
+
 @app.route("/")
 def index():
-    conn = get_db()
-    c = conn.cursor()
+    bookings_per_day = cached_availability(get_db(), next_saturdays())
+
+    return render_template(
+        "index.html", days=[(d, n, cap) for d, (n, cap) in bookings_per_day.items()]
+    )
 
-    sats = next_saturdays()
 
-    bookings_per_day = {}
-    for d in sats:
-        c.execute(
-            "SELECT COUNT(*) as cnt FROM bookings WHERE visit_date = ?",
-            (d.isoformat(),),
-        )
-        bookings_per_day[d] = c.fetchone()["cnt"]
+# ---------------------------
+# JSON AVAILABILITY API
+# ---------------------------
 
-    conn.close()
+# Seconds a client or reverse proxy may reuse a response without asking again
+API_MAX_AGE = int(os.environ.get("API_MAX_AGE", "10"))
 
-    template = """
-    <!doctype html>
-    <html>
-    <head>
-        <title>Prison Visit Booking</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style>
-            body { font-family: sans-serif; max-width: 700px; margin: 20px auto; padding: 0 10px; }
-            .date-card { border: 1px solid #ccc; border-radius: 8px; padding: 10px 15px; margin-bottom: 10px; }
-            .full { background: #f8d7da; }
-            .available { background: #d4edda; }
-            .btn { padding: 6px 12px; border-radius: 4px; border: none; cursor: pointer; }
-            .btn-primary { background: #007bff; color: white; }
-            .btn-disabled { background: #aaa; color: #eee; cursor: not-allowed; }
-            .flash { padding: 8px 10px; border-radius: 4px; margin-bottom: 10px; }
-            .flash-error { background: #f8d7da; }
-            .flash-success { background: #d4edda; }
-        </style>
-    </head>
-    <body>
-        <h1>Book a Visit</h1>
-        <p>Choose a Saturday. Max 2 visitors per day.</p>
-
-        {% with messages = get_flashed_messages(with_categories=true) %}
-          {% if messages %}
-            {% for category, msg in messages %}
-              <div class="flash flash-{{ category }}">{{ msg }}</div>
-            {% endfor %}
-          {% endif %}
-        {% endwith %}
-
-        {% for d, count in days %}
-            <div class="date-card {% if count >= 2 %}full{% else %}available{% endif %}">
-                <strong>{{ d.strftime("%A %d %B %Y") }}</strong><br>
-                Booked: {{ count }}/2
-                <div style="margin-top:8px;">
-                {% if count < 2 %}
-                    <form method="get" action="{{ url_for('book') }}" style="display:inline;">
-                        <input type="hidden" name="date" value="{{ d.isoformat() }}">
-                        <button class="btn btn-primary" type="submit">Book</button>
-                    </form>
-                {% else %}
-                    <button class="btn btn-disabled" disabled>Full</button>
-                {% endif %}
-                </div>
-            </div>
-        {% endfor %}
 
-        <p><a href="{{ url_for('admin_login') }}">Admin</a></p>
-    </body>
-    </html>
-    """
-    return render_template_string(template, days=list(bookings_per_day.items()))
+@app.route("/api/availability")
+def api_availability():
+    weeks = request.args.get("weeks", BOOKING_WEEKS, type=int)
+    days = next_saturdays(min(max(weeks, 1), 52))
+
+    # The tag changes with any slot write and when the horizon moves on, so
+    # a matching If-None-Match can be answered without loading any counts
+    conn = get_db()
+    version = availability_cache.version(conn)
+    etag = f"{version}-{days[0].isoformat()}-{len(days)}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        counts = cached_availability(conn, days)
+        response = jsonify(
+            version=version,
+            days=[
+                {
+                    "date": d.isoformat(),
+                    "booked": booked,
+                    "capacity": capacity,
+                    "available": max(capacity - booked, 0),
+                }
+                for d, (booked, capacity) in counts.items()
+            ],
+        )
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = API_MAX_AGE
+    return response
 
 
 # ---------------------------
@@ -195,44 +1483,100 @@ def index():
 # ---------------------------
 
 
-@app.route("/book", methods=["GET", "POST"])
-def book():
-    if request.method == "GET":
-        visit_date_str = request.args.get("date")
-    else:
-        visit_date_str = request.form.get("visit_date")
+BOOK_TEMPLATE = """
+<!doctype html>
+<html>
+<head>
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <style>
+        body { font-family: sans-serif; max-width: 600px; margin: 20px auto; padding: 0 10px; }
+        label { display: block; margin-top: 10px; }
+        input { width: 100%; padding: 6px; margin-top: 4px; box-sizing: border-box; }
+        .btn { margin-top: 15px; padding: 8px 12px; border-radius: 4px; border: none; background: #007bff; color: white; cursor: pointer; }
+        .flash { padding: 8px 10px; border-radius: 4px; margin-bottom: 10px; }
+        .flash-error { background: #f8d7da; }
+    </style>
+</head>
+<body>
+    <h2>Book for {{ visit_date.strftime("%A %d %B %Y") }}</h2>
+
+    {% with messages = get_flashed_messages(with_categories=true) %}
+      {% if messages %}
+        {% for category, msg in messages %}
+          <div class="flash flash-{{ category }}">{{ msg }}</div>
+        {% endfor %}
+      {% endif %}
+    {% endwith %}
+
+    <form method="post">
+        <input type="hidden" name="visit_date" value="{{ visit_date.isoformat() }}">
+        <input type="hidden" name="idempotency_key" value="{{ idempotency_key }}">
+
+        <label>First name
+            <input type="text" name="first_name" required>
+        </label>
+
+        <label>Last name
+            <input type="text" name="last_name" required>
+        </label>
+
+        <label>Social security number
+            <input type="text" name="ssn" required>
+        </label>
 
+        <label>Phone number
+            <input type="text" name="phone" required>
+        </label>
+
+        <label>Email
+            <input type="email" name="email" required>
+        </label>
+
+        <button class="btn" type="submit">Confirm</button>
+    </form>
+    <p><a href="{{ url_for('index') }}">← Back</a></p>
+</body>
+</html>
+"""
+
+
+def check_visit_date(visit_date_str):
+    """Apply the booking rules to a YYYY-MM-DD string.
+
+    Returns (visit_date, None) if the date can be booked, otherwise
+    (None, error message).
+    """
     if not visit_date_str:
-        flash("No date selected.", "error")
-        return redirect(url_for("index"))
+        return None, "No date selected."
 
     try:
         visit_date = datetime.strptime(visit_date_str, "%Y-%m-%d").date()
     except ValueError:
-        flash("Invalid date.", "error")
-        return redirect(url_for("index"))
+        return None, "Invalid date."
 
     if visit_date.weekday() != 5:
-        flash("Only Saturdays can be booked.", "error")
-        return redirect(url_for("index"))
+        return None, "Only Saturdays can be booked."
 
     if visit_date < date.today():
-        flash("You cannot book a past date.", "error")
-        return redirect(url_for("index"))
+        return None, "You cannot book a past date."
 
-    conn = get_db()
-    c = conn.cursor()
-    c.execute(
-        "SELECT COUNT(*) as cnt FROM bookings WHERE visit_date = ?",
-        (visit_date.isoformat(),),
-    )
-    booked = c.fetchone()["cnt"]
+    return visit_date, None
 
-    if booked >= 2:
-        conn.close()
-        flash("This day is already full.", "error")
+
+@app.route("/book", methods=["GET", "POST"])
+def book():
+    if request.method == "GET":
+        visit_date_str = request.args.get("date")
+    else:
+        visit_date_str = request.form.get("visit_date")
+
+    visit_date, error = check_visit_date(visit_date_str)
+    if error:
+        flash(error, "error")
         return redirect(url_for("index"))
 
+    conn = get_db()
+
     if request.method == "POST":
         first_name = request.form.get("first_name", "").strip()
         last_name = request.form.get("last_name", "").strip()
@@ -242,154 +1586,265 @@ def book():
 
         if not (first_name and last_name and ssn and phone and email):
             flash("Please fill in all fields.", "error")
-            conn.close()
             return redirect(url_for("book") + f"?date={visit_date_str}")
 
-        c.execute(
-            """
-            INSERT INTO bookings (
-                visit_date, first_name, last_name, ssn, phone, email, created_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                visit_date.isoformat(),
-                first_name,
-                last_name,
-                ssn,
-                phone,
-                email,
-                datetime.utcnow().isoformat(),
-            ),
+        outcome, booking_id, replayed = insert_booking(
+            conn,
+            visit_date,
+            first_name,
+            last_name,
+            ssn,
+            phone,
+            email,
+            idempotency_key=request.form.get("idempotency_key", "")[:64] or None,
         )
-        conn.commit()
-        conn.close()
+        if outcome == "full":
+            flash("This day is already full.", "error")
+            return redirect(url_for("index"))
+        if outcome == "duplicate":
+            flash("This visitor is already booked on that day.", "error")
+            return redirect(url_for("index"))
+        if outcome == "cancelled":
+            flash("This booking has been cancelled.", "error")
+            return redirect(url_for("index"))
+        if not replayed:
+            availability_cache.clear()
         flash("Your visit has been booked.", "success")
         return redirect(url_for("index"))
 
-    template = """
-    <!doctype html>
-    <html>
-    <head>
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style>
-            body { font-family: sans-serif; max-width: 600px; margin: 20px auto; padding: 0 10px; }
-            label { display: block; margin-top: 10px; }
-            input { width: 100%; padding: 6px; margin-top: 4px; box-sizing: border-box; }
-            .btn { margin-top: 15px; padding: 8px 12px; border-radius: 4px; border: none; background: #007bff; color: white; cursor: pointer; }
-            .flash { padding: 8px 10px; border-radius: 4px; margin-bottom: 10px; }
-            .flash-error { background: #f8d7da; }
-        </style>
-    </head>
-    <body>
-        <h2>Book for {{ visit_date.strftime("%A %d %B %Y") }}</h2>
-
-        {% with messages = get_flashed_messages(with_categories=true) %}
-          {% if messages %}
-            {% for category, msg in messages %}
-              <div class="flash flash-{{ category }}">{{ msg }}</div>
-            {% endfor %}
-          {% endif %}
-        {% endwith %}
-
-        <form method="post">
-            <input type="hidden" name="visit_date" value="{{ visit_date.isoformat() }}">
-
-            <label>First name
-                <input type="text" name="first_name" required>
-            </label>
-
-            <label>Last name
-                <input type="text" name="last_name" required>
-            </label>
-
-            <label>Social security number
-                <input type="text" name="ssn" required>
-            </label>
-
-            <label>Phone number
-                <input type="text" name="phone" required>
-            </label>
-
-            <label>Email
-                <input type="email" name="email" required>
-            </label>
-
-            <button class="btn" type="submit">Confirm</button>
-        </form>
-        <p><a href="{{ url_for('index') }}">← Back</a></p>
-    </body>
-    </html>
-    """
-    conn.close()
-    return render_template_string(template, visit_date=visit_date)
+    booked, capacity = availability(conn, [visit_date])[visit_date]
+    if booked >= capacity:
+        flash("This day is already full.", "error")
+        return redirect(url_for("index"))
+
+    return render_template(
+        "book.html", visit_date=visit_date, idempotency_key=uuid.uuid4().hex
+    )
 
 
 # ---------------------------
 # ADMIN PAGE + DELETE
 # ---------------------------
 
+ADMIN_PAGE_SIZE = int(os.environ.get("ADMIN_PAGE_SIZE", "50"))
+ADMIN_SEARCH_LIMIT = int(os.environ.get("ADMIN_SEARCH_LIMIT", "50"))
+
+
+def parse_date_arg(value):
+    """Parse a YYYY-MM-DD query argument, returning None if absent/invalid."""
+    try:
+        return datetime.strptime(value or "", "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def booking_filters(args):
+    """Turn from/to/upcoming query arguments into SQL conditions.
+
+    Returns (filters, where, params): the normalized filter values to echo
+    back into links and forms, plus WHERE clauses and their parameters.
+    """
+    start = parse_date_arg(args.get("from"))
+    end = parse_date_arg(args.get("to"))
+
+    filters, where, params = {}, [], []
+    if start:
+        filters["from"] = start.isoformat()
+        where.append("visit_date >= ?")
+        params.append(start.isoformat())
+    if end:
+        filters["to"] = end.isoformat()
+        where.append("visit_date <= ?")
+        params.append(end.isoformat())
+    if args.get("upcoming") == "1":
+        filters["upcoming"] = "1"
+        where.append("visit_date >= ?")
+        params.append(date.today().isoformat())
+    return filters, where, params
+
+
+# Digits with the separators people type in phone numbers, e.g. "(070) 123-45"
+_PHONE_CHAR = rf"[\d\s{re.escape(PHONE_SEPARATORS)}]"
+PHONE_QUERY = re.compile(rf"{_PHONE_CHAR}*\d{_PHONE_CHAR}*")
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query: every word, as a prefix, must match.
+
+    A phone-like query is reduced to its digits, the way NORMALIZED_PHONE
+    indexes phone numbers. Anything else is split into words as unicode61
+    does, so "Anne-Marie" and "jean-luc@ex-ample.com" keep all their parts.
+    """
+    if PHONE_QUERY.fullmatch(text.strip()):
+        words = ["".join(re.findall(r"\d", text))]
+    else:
+        words = re.findall(r"\w+", text)
+    return " AND ".join(f'"{w}"*' for w in words)
+
+
+def search_bookings(conn, text, where, params, limit=ADMIN_SEARCH_LIMIT):
+    """Return the best limit matches for text in name, email or phone."""
+    query = fts_query(text)
+    if not query:
+        return []
+    sql = """
+        SELECT bookings.* FROM bookings_fts
+        JOIN bookings ON bookings.id = bookings_fts.rowid
+        WHERE bookings_fts MATCH ?
+    """
+    for clause in where:
+        sql += " AND " + clause
+    sql += " ORDER BY bookings_fts.rank LIMIT ?"
+    return conn.execute(sql, [query, *params, limit]).fetchall()
+
+
+def parse_cursor(value):
+    """Split an admin page cursor into (visit_date, created_at, id)."""
+    try:
+        visit_date, created_at, booking_id = (value or "").split("_")
+        return [visit_date, created_at, int(booking_id)]
+    except ValueError:
+        return None
+
+
+ADMIN_TEMPLATE = """
+<!doctype html>
+<html>
+<head>
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <style>
+        body { font-family: sans-serif; max-width: 1000px; margin: 20px auto; padding: 0 10px; }
+        table { border-collapse: collapse; width: 100%; }
+        th, td { border: 1px solid #ccc; padding: 6px 8px; }
+        th { background: #eee; }
+        form { margin: 0; }
+        button { padding: 4px 8px; }
+    </style>
+</head>
+<body>
+    <h1>All bookings</h1>
+    <p><a href="{{ url_for('logout') }}">Logout</a></p>
+
+    {% with messages = get_flashed_messages(with_categories=true) %}
+      {% if messages %}
+        {% for category, msg in messages %}
+          <p>{{ msg }}</p>
+        {% endfor %}
+      {% endif %}
+    {% endwith %}
+
+    <form method="get" action="{{ url_for('admin') }}" style="margin-bottom: 10px;">
+        Search <input type="search" name="q" value="{{ q }}" placeholder="Name, email or phone">
+        From <input type="date" name="from" value="{{ filters.get('from', '') }}">
+        To <input type="date" name="to" value="{{ filters.get('to', '') }}">
+        <label><input type="checkbox" name="upcoming" value="1" {% if filters.get('upcoming') %}checked{% endif %}> Upcoming only</label>
+        <button type="submit">Filter</button>
+        <a href="{{ url_for('admin') }}">Clear</a>
+    </form>
+    <form method="post" action="{{ url_for('import_bookings_view') }}" enctype="multipart/form-data" style="margin-bottom: 10px;">
+        Import bookings (CSV or JSON with visit_date, first_name, last_name, ssn, phone, email):
+        <input type="file" name="file" accept=".csv,.json">
+        <button type="submit">Import</button>
+    </form>
+    <form id="bulk-delete" method="post" action="{{ url_for('bulk_delete') }}" onsubmit="return confirm('Delete these bookings?');" style="margin-bottom: 10px;">
+        Cancel every booking on <input type="date" name="visit_date">
+        <button type="submit">Delete selected / day</button>
+    </form>
+    <p>
+        Export:
+        <a href="{{ url_for('export_bookings', fmt='csv', **filters) }}">CSV</a> |
+        <a href="{{ url_for('export_bookings', fmt='jsonl', **filters) }}">JSON Lines</a> |
+        <a href="{{ url_for('archive_search') }}">Search archived bookings</a>
+    </p>
+
+    {% if q %}
+      <p>Best matches for "{{ q }}" (<a href="{{ url_for('admin', **filters) }}">show all</a>)</p>
+    {% endif %}
+
+    <table>
+        <tr>
+            <th></th>
+            <th>Date</th>
+            <th>First</th>
+            <th>Last</th>
+            <th>SSN</th>
+            <th>Phone</th>
+            <th>Email</th>
+            <th>Booked at (UTC)</th>
+            <th>Actions</th>
+        </tr>
+        {% for r in rows %}
+        <tr>
+            <td><input type="checkbox" name="ids" value="{{ r['id'] }}" form="bulk-delete"></td>
+            <td>{{ r["visit_date"] }}</td>
+            <td>{{ r["first_name"] }}</td>
+            <td>{{ r["last_name"] }}</td>
+            <td>{{ r["ssn"] }}</td>
+            <td>{{ r["phone"] }}</td>
+            <td>{{ r["email"] }}</td>
+            <td>{{ r["created_at"] }}</td>
+            <td>
+                <form method="post" action="{{ url_for('delete_booking', booking_id=r['id']) }}" onsubmit="return confirm('Delete this booking?');">
+                    <button type="submit">Delete</button>
+                </form>
+            </td>
+        </tr>
+        {% endfor %}
+    </table>
+    <p>
+        {% if request.args.get('after') %}
+          <a href="{{ url_for('admin', **filters) }}">« First page</a>
+        {% endif %}
+        {% if next_cursor %}
+          <a href="{{ url_for('admin', after=next_cursor, **filters) }}">Next page »</a>
+        {% endif %}
+    </p>
+    <p><a href="{{ url_for('index') }}">← Back to site</a></p>
+</body>
+</html>
+"""
+
 
 @app.route("/admin")
 def admin():
     if not session.get("admin"):
         return redirect(url_for("admin_login"))
 
+    filters, where, params = booking_filters(request.args)
+
+    q = request.args.get("q", "").strip()
+    if q:
+        rows = search_bookings(get_db(), q, where, params)
+        return render_template(
+            "admin.html", rows=rows, filters=filters, next_cursor=None, q=q
+        )
+
+    # Keyset pagination: continue strictly after the last row shown, so each
+    # page is an index range scan no matter how many rows came before it
+    cursor = parse_cursor(request.args.get("after"))
+    if cursor:
+        where.append("(visit_date, created_at, id) > (?, ?, ?)")
+        params.extend(cursor)
+
+    sql = "SELECT * FROM bookings"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY visit_date, created_at, id LIMIT ?"
+
     conn = get_db()
     c = conn.cursor()
-    c.execute("SELECT * FROM bookings ORDER BY visit_date, created_at")
+    c.execute(sql, params + [ADMIN_PAGE_SIZE + 1])
     rows = c.fetchall()
-    conn.close()
 
-    template = """
-    <!doctype html>
-    <html>
-    <head>
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style>
-            body { font-family: sans-serif; max-width: 1000px; margin: 20px auto; padding: 0 10px; }
-            table { border-collapse: collapse; width: 100%; }
-            th, td { border: 1px solid #ccc; padding: 6px 8px; }
-            th { background: #eee; }
-            form { margin: 0; }
-            button { padding: 4px 8px; }
-        </style>
-    </head>
-    <body>
-        <h1>All bookings</h1>
-        <p><a href="{{ url_for('logout') }}">Logout</a></p>
-        <table>
-            <tr>
-                <th>Date</th>
-                <th>First</th>
-                <th>Last</th>
-                <th>SSN</th>
-                <th>Phone</th>
-                <th>Email</th>
-                <th>Booked at (UTC)</th>
-                <th>Actions</th>
-            </tr>
-            {% for r in rows %}
-            <tr>
-                <td>{{ r["visit_date"] }}</td>
-                <td>{{ r["first_name"] }}</td>
-                <td>{{ r["last_name"] }}</td>
-                <td>{{ r["ssn"] }}</td>
-                <td>{{ r["phone"] }}</td>
-                <td>{{ r["email"] }}</td>
-                <td>{{ r["created_at"] }}</td>
-                <td>
-                    <form method="post" action="{{ url_for('delete_booking', booking_id=r['id']) }}" onsubmit="return confirm('Delete this booking?');">
-                        <button type="submit">Delete</button>
-                    </form>
-                </td>
-            </tr>
-            {% endfor %}
-        </table>
-        <p><a href="{{ url_for('index') }}">← Back to site</a></p>
-    </body>
-    </html>
-    """
-    return render_template_string(template, rows=rows)
+    next_cursor = None
+    if len(rows) > ADMIN_PAGE_SIZE:
+        rows = rows[:ADMIN_PAGE_SIZE]
+        last = rows[-1]
+        next_cursor = f"{last['visit_date']}_{last['created_at']}_{last['id']}"
+
+    return render_template(
+        "admin.html", rows=rows, filters=filters, next_cursor=next_cursor, q=""
+    )
 
 
 @app.route("/admin/delete/<int:booking_id>", methods=["POST"])
@@ -398,20 +1853,574 @@ def delete_booking(booking_id):
         return redirect(url_for("admin_login"))
 
     conn = get_db()
-    c = conn.cursor()
-    c.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
-    conn.commit()
-    conn.close()
+    # The delete and the jobs reporting it commit together or not at all
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT * FROM bookings WHERE id = ?", (booking_id,)
+        ).fetchone()
+        if row:
+            conn.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
+            enqueue_audit(
+                conn,
+                "booking_deleted",
+                commit=False,
+                booking_id=booking_id,
+                visit_date=row["visit_date"],
+            )
+            enqueue_visit_email(
+                conn,
+                "cancelled",
+                row["email"],
+                row["first_name"],
+                date.fromisoformat(row["visit_date"]),
+                commit=False,
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    availability_cache.clear()
 
     flash("Booking deleted.", "success")
     return redirect(url_for("admin"))
 
 
+# ---------------------------
+# ADMIN BULK IMPORT / DELETE
+# ---------------------------
+
+BOOKING_FIELDS = ("visit_date", "first_name", "last_name", "ssn", "phone", "email")
+
+
+def parse_import(upload):
+    """Read an uploaded CSV or JSON file into a list of booking dicts."""
+    text = upload.read().decode("utf-8-sig")
+    if upload.filename.lower().endswith(".json"):
+        try:
+            records = json.loads(text)
+        except ValueError:
+            raise ValueError("File is not valid JSON.")
+        if not isinstance(records, list) or not all(
+            isinstance(r, dict) for r in records
+        ):
+            raise ValueError("JSON must be a list of booking objects.")
+        return records
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def import_bookings(conn, records, filename=None):
+    """Insert all records in one transaction, or none of them.
+
+    Every row must pass the same date rules as book(), have all fields
+    filled in, and fit in its Saturday's remaining capacity. Each visitor's
+    confirmation email and one audit entry for the import are queued in
+    the same transaction. Returns the number of bookings inserted; raises
+    ValueError describing the first problem otherwise.
+    """
+    rows = []
+    visitors = []
+    per_day = {}
+    created_at = datetime.utcnow().isoformat()
+    for n, record in enumerate(records, start=1):
+        values = [str(record.get(f) or "").strip() for f in BOOKING_FIELDS]
+        visit_date, error = check_visit_date(values[0])
+        if error:
+            raise ValueError(f"Row {n}: {error}")
+        if not all(values[1:]):
+            raise ValueError(f"Row {n}: Please fill in all fields.")
+        per_day[visit_date] = per_day.get(visit_date, 0) + 1
+        rows.append((visit_date.isoformat(), *values[1:], created_at))
+        visitors.append((visit_date, values[1], values[5]))
+
+    if not rows:
+        raise ValueError("No bookings found in file.")
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for d in per_day:
+            ensure_slot(conn, d)
+        current = availability(conn, list(per_day))
+        for d, n in sorted(per_day.items()):
+            booked, capacity = current[d]
+            if booked + n > capacity:
+                raise ValueError(
+                    f"{d.isoformat()}: {n} bookings do not fit "
+                    f"({booked}/{capacity} already booked)."
+                )
+        try:
+            conn.executemany(
+                """
+                INSERT INTO bookings (
+                    visit_date, first_name, last_name, ssn, phone, email, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+        except sqlite3.IntegrityError:
+            raise ValueError(
+                "A visitor (same SSN) is booked twice on the same day, "
+                "in the file or already."
+            )
+        for visit_date, first_name, email in visitors:
+            enqueue_visit_email(
+                conn, "booked", email, first_name, visit_date, commit=False
+            )
+        enqueue_audit(
+            conn,
+            "bookings_imported",
+            commit=False,
+            count=len(rows),
+            filename=filename,
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
+
+def delete_bookings(conn, booking_ids=(), visit_date=None):
+    """Delete bookings by id and/or every booking on visit_date at once.
+
+    Each deleted visitor's cancellation email and one audit entry for the
+    batch are queued in the same transaction.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            """
+            SELECT id, visit_date, first_name, email FROM bookings
+            WHERE id IN (SELECT value FROM json_each(?)) OR visit_date = ?
+            ORDER BY id
+            """,
+            (json.dumps(list(booking_ids)), visit_date and visit_date.isoformat()),
+        ).fetchall()
+        deleted = 0
+        if booking_ids:
+            c = conn.executemany(
+                "DELETE FROM bookings WHERE id = ?", [(i,) for i in booking_ids]
+            )
+            deleted += c.rowcount
+        if visit_date:
+            c = conn.execute(
+                "DELETE FROM bookings WHERE visit_date = ?", (visit_date.isoformat(),)
+            )
+            deleted += c.rowcount
+        for row in rows:
+            enqueue_visit_email(
+                conn,
+                "cancelled",
+                row["email"],
+                row["first_name"],
+                date.fromisoformat(row["visit_date"]),
+                commit=False,
+            )
+        enqueue_audit(
+            conn,
+            "bookings_deleted",
+            commit=False,
+            count=deleted,
+            booking_ids=[row["id"] for row in rows],
+            visit_date=visit_date and visit_date.isoformat(),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return deleted
+
+
+@app.route("/admin/import", methods=["POST"])
+def import_bookings_view():
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("Choose a CSV or JSON file to import.", "error")
+        return redirect(url_for("admin"))
+
+    try:
+        count = import_bookings(
+            get_db(), parse_import(upload), filename=upload.filename
+        )
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        flash(f"Import failed, nothing was saved. {e}", "error")
+        return redirect(url_for("admin"))
+
+    availability_cache.clear()
+    flash(f"Imported {count} bookings.", "success")
+    return redirect(url_for("admin"))
+
+
+@app.route("/admin/bulk-delete", methods=["POST"])
+def bulk_delete():
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    ids = []
+    for part in request.form.getlist("ids"):
+        ids.extend(int(i) for i in part.replace(",", " ").split() if i.isdigit())
+    visit_date = parse_date_arg(request.form.get("visit_date"))
+
+    if not ids and not visit_date:
+        flash("Select bookings or a date to delete.", "error")
+        return redirect(url_for("admin"))
+
+    conn = get_db()
+    deleted = delete_bookings(conn, ids, visit_date)
+    availability_cache.clear()
+    flash(f"Deleted {deleted} bookings.", "success")
+    return redirect(url_for("admin"))
+
+
+# ---------------------------
+# ADMIN EXPORT
+# ---------------------------
+
+EXPORT_BATCH_SIZE = 500
+
+
+def export_rows(sql, params, fmt):
+    """Yield the query result as CSV or JSON Lines, one batch at a time.
+
+    Uses its own connection because the response is streamed after the
+    request's app context (and its pooled connection) has been released.
+    """
+    conn = connect()
+    try:
+        c = conn.execute(sql, params)
+        columns = [col[0] for col in c.description]
+        if fmt == "csv":
+            buf = io.StringIO()
+            csv.writer(buf).writerow(columns)
+            yield buf.getvalue()
+        while True:
+            rows = c.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            if fmt == "csv":
+                buf = io.StringIO()
+                csv.writer(buf).writerows(rows)
+                yield buf.getvalue()
+            else:
+                yield "".join(json.dumps(dict(zip(columns, r))) + "\n" for r in rows)
+    finally:
+        conn.close()
+
+
+@app.route("/admin/export.<fmt>")
+def export_bookings(fmt):
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    if fmt not in ("csv", "jsonl"):
+        abort(404)
+
+    filters, where, params = booking_filters(request.args)
+    sql = "SELECT * FROM bookings"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY visit_date, created_at, id"
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    filename = f"bookings-{date.today().isoformat()}.{fmt}"
+    return Response(
+        export_rows(sql, params, fmt),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
+# ---------------------------
+# ARCHIVE
+# ---------------------------
+
+# Bookings this many days in the past move to the archive
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "30"))
+
+# Optional separate file for the archive; default is a table in DB_PATH
+ARCHIVE_DB_PATH = os.environ.get("ARCHIVE_DB_PATH", "")
+
+ARCHIVE_SEARCH_LIMIT = 100
+
+
+def attach_archive(conn, create=False):
+    """Make the archive table available on conn; return its schema name.
+
+    The in-file archive is created by migrate_archive. A separate
+    ARCHIVE_DB_PATH file is only created, or brought up to date, with
+    create=True ('flask archive'); until then this returns None.
+    """
+    if not ARCHIVE_DB_PATH:
+        return "main"
+    if not create and not os.path.exists(ARCHIVE_DB_PATH):
+        return None
+    attached = [row["name"] for row in conn.execute("PRAGMA database_list")]
+    if "archive" not in attached:
+        conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+    if create:
+        create_archive_schema(conn, "archive")
+        conn.commit()
+    elif not conn.execute(
+        "SELECT 1 FROM archive.sqlite_master WHERE name = 'bookings_archive_fts'"
+    ).fetchone():
+        return None
+    return "archive"
+
+
+def archive_bookings(conn, cutoff, batch_size=500, pause=0.05):
+    """Move bookings dated before cutoff to the archive, batch by batch.
+
+    Each batch is its own short write transaction with a pause in between,
+    so live bookings are never blocked for long. The copy is INSERT OR
+    IGNORE, so a batch interrupted between copy and delete (possible when
+    the archive is a separate file) is finished by the next run. Returns
+    the number of bookings moved.
+    """
+    schema = attach_archive(conn, create=True)
+    moved = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [
+                row["id"]
+                for row in conn.execute(
+                    """
+                    SELECT id FROM bookings WHERE visit_date < ?
+                    ORDER BY visit_date, created_at, id LIMIT ?
+                    """,
+                    (cutoff.isoformat(), batch_size),
+                )
+            ]
+            if ids:
+                marks = ",".join("?" * len(ids))
+                conn.execute(
+                    f"""
+                    INSERT OR IGNORE INTO {schema}.bookings_archive
+                    SELECT id, visit_date, first_name, last_name, ssn, phone,
+                           email, created_at, ?
+                    FROM bookings WHERE id IN ({marks})
+                    """,
+                    [datetime.utcnow().isoformat(), *ids],
+                )
+                conn.execute(f"DELETE FROM bookings WHERE id IN ({marks})", ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        moved += len(ids)
+        if len(ids) < batch_size:
+            return moved
+        time.sleep(pause)
+
+
+def reclaim_pages(conn, step=1000, pause=0.05):
+    """Return free pages to the OS in small incremental_vacuum steps.
+
+    Returns False if the database was not created with incremental
+    auto_vacuum and needs a one-off full VACUUM first.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return False
+    while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+        conn.execute(f"PRAGMA incremental_vacuum({step})").fetchall()
+        time.sleep(pause)
+    return True
+
+
+ARCHIVE_TEMPLATE = """
+<!doctype html>
+<html>
+<head>
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <style>
+        body { font-family: sans-serif; max-width: 1000px; margin: 20px auto; padding: 0 10px; }
+        table { border-collapse: collapse; width: 100%; }
+        th, td { border: 1px solid #ccc; padding: 6px 8px; }
+        th { background: #eee; }
+    </style>
+</head>
+<body>
+    <h1>Archived bookings</h1>
+    <form method="get" action="{{ url_for('archive_search') }}" style="margin-bottom: 10px;">
+        Name, email or phone <input type="text" name="q" value="{{ q }}">
+        From <input type="date" name="from" value="{{ filters.get('from', '') }}">
+        To <input type="date" name="to" value="{{ filters.get('to', '') }}">
+        <button type="submit">Search</button>
+    </form>
+    <table>
+        <tr>
+            <th>Date</th>
+            <th>First</th>
+            <th>Last</th>
+            <th>SSN</th>
+            <th>Phone</th>
+            <th>Email</th>
+            <th>Booked at (UTC)</th>
+            <th>Archived at (UTC)</th>
+        </tr>
+        {% for r in rows %}
+        <tr>
+            <td>{{ r["visit_date"] }}</td>
+            <td>{{ r["first_name"] }}</td>
+            <td>{{ r["last_name"] }}</td>
+            <td>{{ r["ssn"] }}</td>
+            <td>{{ r["phone"] }}</td>
+            <td>{{ r["email"] }}</td>
+            <td>{{ r["created_at"] }}</td>
+            <td>{{ r["archived_at"] }}</td>
+        </tr>
+        {% endfor %}
+    </table>
+    {% if rows|length >= limit %}
+      <p>Showing the first {{ limit }} matches; narrow the search to see more.</p>
+    {% endif %}
+    <p><a href="{{ url_for('admin') }}">← Back to bookings</a></p>
+</body>
+</html>
+"""
+
+
+@app.route("/admin/archive")
+def archive_search():
+    if not session.get("admin"):
+        return redirect(url_for("admin_login"))
+
+    filters, where, params = booking_filters(request.args)
+    q = request.args.get("q", "").strip()
+    query = fts_query(q)
+
+    conn = get_db()
+    schema = attach_archive(conn)
+    rows = []
+    if schema and (query or not q):
+        if query:
+            # Same contentless FTS5 index as the live bookings search
+            where.append(
+                f"id IN (SELECT rowid FROM {schema}.bookings_archive_fts"
+                f" WHERE bookings_archive_fts MATCH ?)"
+            )
+            params.append(query)
+        sql = f"SELECT * FROM {schema}.bookings_archive"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY visit_date DESC, created_at DESC, id DESC LIMIT ?"
+        rows = conn.execute(sql, params + [ARCHIVE_SEARCH_LIMIT]).fetchall()
+
+    return render_template(
+        "archive.html", rows=rows, filters=filters, q=q, limit=ARCHIVE_SEARCH_LIMIT
+    )
+
+
+# ---------------------------
+# CLI COMMANDS
+# ---------------------------
+
+
+@app.cli.command("set-capacity")
+@click.argument("visit_date", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.argument("capacity", type=click.IntRange(min=0))
+def set_capacity_command(visit_date, capacity):
+    """Set the number of visitor places for one Saturday."""
+    visit_date = visit_date.date()
+    conn = get_db()
+    ensure_slot(conn, visit_date)
+    conn.execute(
+        "UPDATE slots SET capacity = ? WHERE visit_date = ?",
+        (capacity, visit_date.isoformat()),
+    )
+    conn.commit()
+    click.echo(f"{visit_date.isoformat()}: capacity {capacity}")
+
+
+@app.cli.command("run-worker")
+@click.option("--threads", default=2, show_default=True, help="Jobs run in parallel.")
+@click.option("--poll", default=1.0, show_default=True, help="Idle wait in seconds.")
+@click.option("--once", is_flag=True, help="Exit when no job is due.")
+def run_worker_command(threads, poll, once):
+    """Process queued background jobs (emails, audit log)."""
+    run_worker(threads, poll, once)
+
+
+@app.cli.command("archive")
+@click.option(
+    "--days",
+    default=ARCHIVE_AFTER_DAYS,
+    show_default=True,
+    help="Archive bookings older than this many days.",
+)
+@click.option("--batch", default=500, show_default=True, help="Rows per transaction.")
+@click.option(
+    "--pause", default=0.05, show_default=True, help="Seconds between batches."
+)
+def archive_command(days, batch, pause):
+    """Move past bookings to the archive and reclaim the freed space."""
+    cutoff = date.today() - timedelta(days=days)
+    conn = connect()
+    try:
+        moved = archive_bookings(conn, cutoff, batch, pause)
+        click.echo(f"Archived {moved} bookings dated before {cutoff.isoformat()}.")
+        # Resubmissions only happen within minutes; old keys are dead weight
+        conn.execute(
+            "DELETE FROM idempotency_keys WHERE created_at < ?", (cutoff.isoformat(),)
+        )
+        conn.commit()
+        if not reclaim_pages(conn, pause=pause):
+            click.echo(
+                "auto_vacuum is off for this database; run VACUUM once to enable it."
+            )
+    finally:
+        conn.close()
+
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply pending database schema migrations."""
+    # Importing the app has already applied anything pending
+    before = SCHEMA_VERSION_AT_IMPORT
+    conn = connect()
+    try:
+        after = migrate(conn, echo=click.echo)
+    finally:
+        conn.close()
+    if before == after:
+        click.echo(f"Schema is up to date (version {after}).")
+    else:
+        click.echo(f"Schema migrated from version {before} to {after}.")
+
+
+# ---------------------------
+# TEMPLATE REGISTRY
+# ---------------------------
+
+# All pages are registered by name so Jinja compiles each one once per
+# worker and serves it from its template cache afterwards.
+TEMPLATES = {
+    "admin_login.html": ADMIN_LOGIN_TEMPLATE,
+    "index.html": INDEX_TEMPLATE,
+    "book.html": BOOK_TEMPLATE,
+    "admin.html": ADMIN_TEMPLATE,
+    "archive.html": ARCHIVE_TEMPLATE,
+}
+
+app.jinja_loader = DictLoader(TEMPLATES)
+
+# Optional on-disk bytecode cache so freshly forked workers start warm
+TEMPLATE_CACHE_DIR = os.environ.get("TEMPLATE_CACHE_DIR")
+if TEMPLATE_CACHE_DIR:
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+# Compile everything now rather than on the first request
+for _name in TEMPLATES:
+    app.jinja_env.get_template(_name)
+
+
 # ---------------------------
 # START APP (local dev)
 # ---------------------------
 
 if __name__ == "__main__":
-    # init_db() already called at import, but harmless to call again
-    init_db()
     app.run(debug=True)
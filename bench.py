@@ -0,0 +1,648 @@
+"""Local micro-benchmarks for the booking app.
+
+Run from the repo root, e.g.:
+
+    python bench.py render
+    python bench.py availability
+    python bench.py booking --threads 16
+    python bench.py import --rows 10000
+    python bench.py load --rows 100000 --threads 16 --out before.json
+    python bench.py load --gunicorn 4 --rows 100000 --out after.json
+    python bench.py compare before.json after.json
+
+Benchmarks use a throwaway database (see DB_PATH below) and never leave
+the machine: load runs through Flask's test client, or against a
+gunicorn started on 127.0.0.1.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import date, datetime, timedelta
+
+# Point the app at scratch database and metrics files before it is imported,
+# and measure the app itself rather than the per-IP rate limiter
+_scratch = tempfile.mkdtemp(prefix="prison-bench-")
+os.environ.setdefault("DB_PATH", os.path.join(_scratch, "bench.db"))
+os.environ.setdefault("RATE_LIMIT_DB_PATH", os.path.join(_scratch, "ratelimit.db"))
+os.environ.setdefault("METRICS_DIR", os.path.join(_scratch, "metrics"))
+os.environ.setdefault("RATE_LIMITS_ENABLED", "0")
+
+from flask import render_template, render_template_string  # noqa: E402
+
+import app as prison  # noqa: E402
+
+
+def timed(fn, n):
+    """Run fn() n times and return the mean cost in microseconds."""
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+# ---------------------------
+# TEMPLATE RENDERING
+# ---------------------------
+
+
+def bench_render(args):
+    days = [(d, 0, prison.DEFAULT_CAPACITY) for d in prison.next_saturdays()]
+    contexts = {
+        "admin_login.html": {"error": None},
+        "index.html": {"days": days},
+        "book.html": {"visit_date": days[0][0]},
+        "admin.html": {"rows": [], "filters": {}, "next_cursor": None},
+    }
+
+    print(f"{'template':<20}{'string (us)':>14}{'registry (us)':>16}{'speedup':>10}")
+    with prison.app.test_request_context("/"):
+        for name, ctx in contexts.items():
+            source = prison.TEMPLATES[name]
+            before = timed(lambda: render_template_string(source, **ctx), args.n)
+            after = timed(lambda: render_template(name, **ctx), args.n)
+            print(f"{name:<20}{before:>14.1f}{after:>16.1f}{before / after:>9.1f}x")
+
+
+# ---------------------------
+# AVAILABILITY CACHE
+# ---------------------------
+
+
+def bench_availability(args):
+    conn = prison.connect()
+    days = prison.next_saturdays()
+    for d in days:
+        prison.ensure_slot(conn, d)
+    conn.commit()
+
+    prison.cached_availability(conn, days)
+    uncached = timed(lambda: prison.availability(conn, days), args.n)
+    cached = timed(lambda: prison.cached_availability(conn, days), args.n)
+    conn.close()
+
+    print(f"{'availability()':<24}{'cached hit':>14}{'speedup':>10}")
+    print(f"{uncached:>21.1f} us{cached:>11.1f} us{uncached / cached:>9.1f}x")
+
+
+# ---------------------------
+# CONCURRENT BOOKING
+# ---------------------------
+
+
+def legacy_book(conn, visit_date, capacity, ssn):
+    """The old count-then-insert flow, kept here for comparison."""
+    c = conn.cursor()
+    c.execute(
+        "SELECT COUNT(*) as cnt FROM bookings WHERE visit_date = ?",
+        (visit_date.isoformat(),),
+    )
+    if c.fetchone()["cnt"] >= capacity:
+        return None
+    c.execute(
+        """
+        INSERT INTO bookings (
+            visit_date, first_name, last_name, ssn, phone, email, created_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            visit_date.isoformat(),
+            "Bench",
+            "Visitor",
+            ssn,
+            "0700000000",
+            "bench@example.com",
+            datetime.utcnow().isoformat(),
+        ),
+    )
+    conn.commit()
+    return c.lastrowid
+
+
+def slot_book(conn, visit_date, capacity, ssn):
+    outcome, booking_id, _ = prison.insert_booking(
+        conn,
+        visit_date,
+        "Bench",
+        "Visitor",
+        ssn,
+        "0700000000",
+        "bench@example.com",
+    )
+    return booking_id
+
+
+def run_booking(book_fn, days, threads, attempts, capacity):
+    """Hammer book_fn from several threads; return (seconds, ok, errors)."""
+    ok = [0]
+    errors = [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(n):
+        conn = prison.connect()
+        barrier.wait()
+        for i in range(attempts):
+            d = days[(n + i) % len(days)]
+            try:
+                result = book_fn(conn, d, capacity, f"{n:04d}-{i:06d}")
+            except sqlite3.OperationalError:
+                result = None
+                with lock:
+                    errors[0] += 1
+            if result is not None:
+                with lock:
+                    ok[0] += 1
+        conn.close()
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return time.perf_counter() - start, ok[0], errors[0]
+
+
+def overbooked_days(days, capacity):
+    conn = prison.connect()
+    over = 0
+    for d in days:
+        row = conn.execute(
+            "SELECT COUNT(*) as cnt FROM bookings WHERE visit_date = ?",
+            (d.isoformat(),),
+        ).fetchone()
+        over += row["cnt"] > capacity
+    conn.close()
+    return over
+
+
+def bench_booking(args):
+    days = prison.next_saturdays(2 * args.days)
+    legacy_days, slot_days = days[: args.days], days[args.days :]
+
+    conn = prison.connect()
+    for d in slot_days:
+        prison.ensure_slot(conn, d)
+        conn.execute(
+            "UPDATE slots SET capacity = ? WHERE visit_date = ?",
+            (args.capacity, d.isoformat()),
+        )
+    conn.commit()
+    conn.close()
+
+    print(
+        f"{'flow':<10}{'attempts/s':>12}{'booked':>8}{'errors':>8}"
+        f"{'overbooked days':>17}"
+    )
+    for name, fn, days in (
+        ("legacy", legacy_book, legacy_days),
+        ("slots", slot_book, slot_days),
+    ):
+        secs, ok, errors = run_booking(
+            fn, days, args.threads, args.attempts, args.capacity
+        )
+        rate = args.threads * args.attempts / secs
+        over = overbooked_days(days, args.capacity)
+        print(f"{name:<10}{rate:>12.0f}{ok:>8}{errors:>8}{over:>17}")
+
+
+# ---------------------------
+# BULK IMPORT
+# ---------------------------
+
+
+def bench_import(args):
+    days = prison.next_saturdays(args.days)
+    conn = prison.connect()
+    for d in days:
+        prison.ensure_slot(conn, d)
+    conn.execute("UPDATE slots SET capacity = capacity + ?", (2 * args.rows,))
+    conn.commit()
+
+    records = [
+        {
+            "visit_date": days[i % len(days)].isoformat(),
+            "first_name": "Group",
+            "last_name": f"Visitor {i}",
+            "ssn": f"{i:06d}-0000",
+            "phone": "0700000000",
+            "email": f"visitor{i}@example.com",
+        }
+        for i in range(args.rows)
+    ]
+
+    start = time.perf_counter()
+    for r in records:
+        prison.insert_booking(
+            conn,
+            date.fromisoformat(r["visit_date"]),
+            *(r[f] for f in prison.BOOKING_FIELDS[1:]),
+        )
+    per_row = time.perf_counter() - start
+
+    start = time.perf_counter()
+    deleted = sum(prison.delete_bookings(conn, visit_date=d) for d in days)
+    delete = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prison.import_bookings(conn, records)
+    bulk = time.perf_counter() - start
+    conn.close()
+
+    print(f"{'operation':<24}{'seconds':>10}{'rows/s':>12}")
+    print(f"{'insert one at a time':<24}{per_row:>10.3f}{args.rows / per_row:>12.0f}")
+    print(f"{'bulk import':<24}{bulk:>10.3f}{args.rows / bulk:>12.0f}")
+    print(f"{'bulk delete by date':<24}{delete:>10.3f}{deleted / delete:>12.0f}")
+
+
+# ---------------------------
+# LOAD TEST
+# ---------------------------
+
+# (name, method, weight) of the traffic mix; paths are filled in per request
+ROUTES = (
+    ("GET /", "GET", 60),
+    ("GET /book", "GET", 15),
+    ("POST /book", "POST", 15),
+    ("GET /admin", "GET", 10),
+)
+
+ADMIN_PASSWORD = "bench"
+
+
+def seed_bookings(rows, per_day=100, batch=10000):
+    """Fill bookings with rows of history on past Saturdays."""
+    conn = prison.connect()
+    first = prison.next_saturdays(1)[0]
+    weeks = (rows + per_day - 1) // per_day
+    days = [first - timedelta(weeks=w + 1) for w in range(weeks)]
+    conn.executemany(
+        "INSERT OR IGNORE INTO slots (visit_date, capacity) VALUES (?, ?)",
+        [(d.isoformat(), per_day) for d in days],
+    )
+    created_at = datetime.utcnow().isoformat()
+    for start in range(0, rows, batch):
+        conn.executemany(
+            """
+            INSERT INTO bookings (
+                visit_date, first_name, last_name, ssn, phone, email, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                (
+                    days[i // per_day].isoformat(),
+                    "Seed",
+                    f"Visitor {i}",
+                    f"{i:08d}",
+                    "0700000000",
+                    f"seed{i}@example.com",
+                    created_at,
+                )
+                for i in range(start, min(start + batch, rows))
+            ),
+        )
+        conn.commit()
+    conn.close()
+
+
+class TestClient:
+    """Drives the app in-process through Flask's test client."""
+
+    def __init__(self):
+        self.client = prison.app.test_client()
+
+    def send(self, method, path, form=None):
+        # PROPAGATE_EXCEPTIONS is on, so app errors arrive here, not as a 500
+        try:
+            return self.client.open(path, method=method, data=form).status_code
+        except sqlite3.OperationalError as e:
+            return "locked" if "locked" in str(e) else 500
+        except Exception:
+            return 500
+
+
+class HttpClient:
+    """Drives a local server over a keep-alive HTTP connection."""
+
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        self.cookie = None
+
+    def send(self, method, path, form=None):
+        headers = {}
+        body = None
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            return 599
+        cookie = response.getheader("Set-Cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        return response.status
+
+
+def start_gunicorn(workers):
+    """Start gunicorn on a free local port; return (process, port)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    cmd = [sys.executable, "-m", "gunicorn", "app:app"]
+    cmd += ["-w", str(workers), "--threads", "4", "-b", f"127.0.0.1:{port}"]
+    proc = subprocess.Popen(
+        cmd,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ),
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc, port
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit("gunicorn did not start")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def summarize(latencies, count, errors, seconds):
+    return {
+        "requests": count,
+        "errors": errors,
+        "throughput": round(count / seconds, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_load(args):
+    os.environ["ADMIN_PASSWORD"] = ADMIN_PASSWORD
+    prison.app.config["PROPAGATE_EXCEPTIONS"] = True
+
+    print(f"Seeding {args.rows} bookings ...", file=sys.stderr)
+    seed_bookings(args.rows)
+    conn = prison.connect()
+    days = prison.next_saturdays(args.days)
+    for d in days:
+        prison.ensure_slot(conn, d)
+    conn.executemany(
+        "UPDATE slots SET capacity = ? WHERE visit_date = ?",
+        [(args.capacity, d.isoformat()) for d in days],
+    )
+    conn.commit()
+    conn.close()
+
+    proc = None
+    if args.gunicorn:
+        proc, port = start_gunicorn(args.gunicorn)
+
+        def make_client():
+            return HttpClient(port)
+
+    else:
+        make_client = TestClient
+
+    names = [r[0] for r in ROUTES]
+    weights = [r[2] for r in ROUTES]
+    methods = {r[0]: r[1] for r in ROUTES}
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    # Over HTTP a lock error is just a 500, so it can only be told apart
+    # in-process; None (null in the JSON) means "not measured"
+    lock_errors = [None if args.gunicorn else 0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.threads + 1)
+    stop = threading.Event()
+
+    def worker(n):
+        rng = random.Random(args.seed + n)
+        client = make_client()
+        client.send("POST", "/admin-login", {"password": ADMIN_PASSWORD})
+        local = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        i = 0
+        barrier.wait()
+        try:
+            while not stop.is_set():
+                name = rng.choices(names, weights)[0]
+                d = rng.choice(days).isoformat()
+                form = None
+                if name == "GET /":
+                    path = "/"
+                elif name == "GET /book":
+                    path = f"/book?date={d}"
+                elif name == "POST /book":
+                    path = "/book"
+                    form = {
+                        "visit_date": d,
+                        "first_name": "Load",
+                        "last_name": f"Test {n}-{i}",
+                        "ssn": f"{n:04d}{i:06d}",
+                        "phone": "0700000000",
+                        "email": f"load{n}-{i}@example.com",
+                    }
+                else:
+                    path = "/admin?upcoming=1"
+                i += 1
+                start = time.perf_counter()
+                status = client.send(methods[name], path, form)
+                local[name].append(time.perf_counter() - start)
+                if status == "locked":
+                    local_errors[name] += 1
+                    with lock:
+                        lock_errors[0] += 1
+                elif status >= 500:
+                    local_errors[name] += 1
+        finally:
+            # Merge even if the thread dies, so its samples still count
+            with lock:
+                for name in names:
+                    latencies[name].extend(local[name])
+                    errors[name] += local_errors[name]
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    try:
+        for t in threads:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        time.sleep(args.duration)
+        stop.set()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    conn = prison.connect()
+    overbooked = conn.execute(
+        """
+        SELECT COUNT(*) FROM (
+            SELECT b.visit_date FROM bookings b
+            JOIN slots s ON s.visit_date = b.visit_date
+            GROUP BY b.visit_date HAVING COUNT(*) > MAX(s.capacity)
+        )
+        """
+    ).fetchone()[0]
+    conn.close()
+
+    everything = [x for name in names for x in latencies[name]]
+    target = f"gunicorn -w {args.gunicorn}" if args.gunicorn else "test-client"
+    result = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {
+            "target": target,
+            "rows": args.rows,
+            "threads": args.threads,
+            "duration": args.duration,
+            "days": args.days,
+            "capacity": args.capacity,
+            "seed": args.seed,
+        },
+        "total": summarize(everything, len(everything), sum(errors.values()), elapsed),
+        "routes": {
+            name: summarize(
+                latencies[name], len(latencies[name]), errors[name], elapsed
+            )
+            for name in names
+        },
+        "lock_errors": lock_errors[0],
+        "overbooked_days": overbooked,
+    }
+
+    print_load(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved {args.out}", file=sys.stderr)
+
+
+def print_load(result):
+    print(f"commit {result['commit']}  {result['config']}")
+    print(
+        f"{'route':<14}{'req':>8}{'req/s':>9}{'p50 ms':>9}"
+        f"{'p95 ms':>9}{'p99 ms':>9}{'err':>6}"
+    )
+    rows = list(result["routes"].items()) + [("total", result["total"])]
+    for name, r in rows:
+        print(
+            f"{name:<14}{r['requests']:>8}{r['throughput']:>9.1f}{r['p50_ms']:>9.2f}"
+            f"{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['errors']:>6}"
+        )
+    lock_errors = result["lock_errors"]
+    if lock_errors is None:
+        lock_errors = "n/a"
+    print(f"lock errors: {lock_errors}  overbooked days: {result['overbooked_days']}")
+
+
+def bench_compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"{before['commit']} -> {after['commit']}")
+    print(f"{'route':<14}{'req/s':>18}{'p95 ms':>20}{'p99 ms':>20}")
+    names = list(after["routes"]) + ["total"]
+    for name in names:
+        a = before["total"] if name == "total" else before["routes"].get(name)
+        b = after["total"] if name == "total" else after["routes"][name]
+        if a is None:
+            continue
+        cells = [
+            f"{a[key]:>8.1f} -> {b[key]:<8.1f}"
+            for key in ("throughput", "p95_ms", "p99_ms")
+        ]
+        print(f"{name:<14}" + "".join(f"{c:>20}" for c in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("render", help="per-request template render cost")
+    p.add_argument("-n", type=int, default=2000, help="renders per template")
+    p.set_defaults(func=bench_render)
+
+    p = sub.add_parser("availability", help="availability cache hit vs query")
+    p.add_argument("-n", type=int, default=20000, help="lookups per variant")
+    p.set_defaults(func=bench_availability)
+
+    p = sub.add_parser("booking", help="concurrent booking, overbooking check")
+    p.add_argument("--threads", type=int, default=16)
+    p.add_argument("--attempts", type=int, default=50, help="bookings per thread")
+    p.add_argument("--days", type=int, default=20, help="Saturdays to spread over")
+    p.add_argument("--capacity", type=int, default=2)
+    p.set_defaults(func=bench_booking)
+
+    p = sub.add_parser("import", help="bulk import vs per-row insert throughput")
+    p.add_argument("--rows", type=int, default=10000)
+    p.add_argument("--days", type=int, default=10, help="Saturdays to spread over")
+    p.set_defaults(func=bench_import)
+
+    p = sub.add_parser("load", help="mixed concurrent traffic against the app")
+    p.add_argument("--rows", type=int, default=1000, help="historic bookings to seed")
+    p.add_argument("--threads", type=int, default=8, help="concurrent clients")
+    p.add_argument("--duration", type=float, default=10, help="seconds of traffic")
+    p.add_argument("--days", type=int, default=8, help="Saturdays to book into")
+    p.add_argument("--capacity", type=int, default=1000, help="places per Saturday")
+    p.add_argument(
+        "--gunicorn",
+        type=int,
+        metavar="WORKERS",
+        default=0,
+        help="run a local gunicorn with this many workers",
+    )
+    p.add_argument("--seed", type=int, default=1, help="random seed")
+    p.add_argument("--out", help="save results as JSON")
+    p.set_defaults(func=bench_load)
+
+    p = sub.add_parser("compare", help="compare two saved load results")
+    p.add_argument("before")
+    p.add_argument("after")
+    p.set_defaults(func=bench_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Read by gunicorn from the working directory (see Procfile).
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Same default as app.METRICS_DIR; set here so master and workers agree
+METRICS_DIR = os.environ.setdefault(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "prison-metrics")
+)
+
+
+def on_starting(server):
+    # Start every master with empty metrics, so snapshots left by an
+    # earlier run are not added to this one's totals
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        os.remove(path)
+
+    # Run pending schema migrations once, before any worker forks; workers
+    # then only check PRAGMA user_version on import. This runs in a child
+    # process so the master never imports the app: workers must import it
+    # themselves for HUP and --reload to pick up new code.
+    subprocess.run(
+        [sys.executable, "-m", "flask", "--app", "app", "migrate"],
+        cwd=server.cfg.chdir,
+        check=True,
+    )
+
+
+def child_exit(server, worker):
+    # Fold an exited worker's counts into one cumulative exited.json: totals
+    # never go backwards, a new worker that reuses the pid cannot overwrite
+    # them, and /metrics reads one file per live worker plus this one
+    path = os.path.join(METRICS_DIR, f"{worker.pid}.json")
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    exited = os.path.join(METRICS_DIR, "exited.json")
+    try:
+        with open(exited) as f:
+            total = json.load(f)
+    except (OSError, ValueError):
+        total = {}
+    for name, labels in data.items():
+        for label, hist in labels.items():
+            acc = total.setdefault(name, {}).setdefault(
+                label, {"buckets": [0] * len(hist["buckets"]), "sum": 0.0, "count": 0}
+            )
+            acc["buckets"] = [a + b for a, b in zip(acc["buckets"], hist["buckets"])]
+            acc["sum"] += hist["sum"]
+            acc["count"] += hist["count"]
+    with open(exited + ".tmp", "w") as f:
+        json.dump(total, f)
+    os.replace(exited + ".tmp", exited)
+    os.remove(path)